@@ -24,12 +24,14 @@ v3.0 特性:
 
 import re
 import sys
+import bisect
 import shutil
 import difflib
-import argparse
+import functools
+import itertools
 from pathlib import Path
 from datetime import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from typing import Optional
 from enum import Enum
 
@@ -53,7 +55,7 @@ class MatchResult(Enum):
     MULTIPLE = "multiple"
 
 
-@dataclass
+@dataclass(slots=True)
 class Patch:
     """单个补丁的数据结构"""
     file: str
@@ -64,7 +66,7 @@ class Patch:
     raw: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class ApplyResult:
     """补丁应用结果"""
     success: bool
@@ -75,11 +77,7 @@ class ApplyResult:
     match_line: int = -1
     original_text: str = ""
     new_text: str = ""
-    similar_candidates: list = None
-
-    def __post_init__(self):
-        if self.similar_candidates is None:
-            self.similar_candidates = []
+    similar_candidates: list = field(default_factory=list)
 
 
 # ============== 解析器 ==============
@@ -87,60 +85,69 @@ class ApplyResult:
 class FIUPParser:
     """解析 FIUP v3.0 格式的补丁"""
     
-    # 匹配 ```fiup ... ``` 代码块
-    CODE_BLOCK_PATTERN = re.compile(r'```(?:fiup)?\s*\n([\s\S]*?)```', re.MULTILINE)
+    # 匹配单个 FIUP 块（```fiup 代码块包裹在块外，无需单独剥离）
+    # 块内不允许再出现 <<<FIUP>>>，正文中提到的标记不会把其后的文字并入块中
+    BLOCK_PATTERN = re.compile(r'<<<FIUP>>>((?:(?!<<<FIUP>>>)[\s\S])*?)<<<END>>>', re.MULTILINE)
+    # [OP]: 取值 -> 操作类型
+    OP_MAP = {op.value: op for op in Operation}
     
-    # 匹配单个 FIUP 块
-    BLOCK_PATTERN = re.compile(r'<<<FIUP>>>([\s\S]*?)<<<END>>>', re.MULTILINE)
+    @classmethod
+    def parse(cls, text: str) -> list[Patch]:
+        """解析补丁文本，返回补丁列表（每次返回新的 Patch 副本，可自由修改）"""
+        return [replace(patch) for patch in cls._parse_cached(text)]
     
     @classmethod
-    def _strip_code_blocks(cls, text: str) -> str:
-        """移除 ```fiup 代码块包裹，提取内容"""
-        extracted = []
-        for match in cls.CODE_BLOCK_PATTERN.finditer(text):
-            extracted.append(match.group(1))
-        
-        if extracted:
-            return '\n'.join(extracted)
-        return text
+    def clear_cache(cls):
+        """清空解析/验证缓存（长时间运行时使用）"""
+        cls._parse_cached.cache_clear()
+        cls._validate_cached.cache_clear()
     
     @classmethod
-    def parse(cls, text: str) -> list[Patch]:
-        """解析补丁文本，返回补丁列表"""
-        # 先移除代码块包裹
-        content = cls._strip_code_blocks(text)
-        
+    @functools.lru_cache(maxsize=8)
+    def _parse_cached(cls, text: str) -> tuple[Patch, ...]:
+        """解析补丁文本，结果按文本缓存（共享对象，不要修改）"""
+        # 统一换行符（如 Windows 剪贴板的 CRLF），否则 \r 会留在锚点与内容的行尾
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
         patches = []
+        # 行号增量计算：只统计上一个块到当前块之间的换行，不切片
+        line_number = 1
+        last_pos = 0
         
-        for match in cls.BLOCK_PATTERN.finditer(content):
+        for match in cls.BLOCK_PATTERN.finditer(text):
             raw = match.group(0)
             inner = match.group(1)
-            line_number = text[:match.start()].count('\n') + 1
-            
-            # 解析 [FILE]:
-            file_match = re.search(r'\[FILE\]:\s*(.+?)(?:\n|$)', inner)
-            file_path = file_match.group(1).strip() if file_match else ''
+            line_number += text.count('\n', last_pos, match.start())
+            last_pos = match.start()
             
-            # 解析 [OP]:
-            op_match = re.search(r'\[OP\]:\s*(REPLACE|INSERT_AFTER|INSERT_BEFORE|DELETE|CREATE)(?:\n|$)', inner, re.IGNORECASE)
-            operation_str = op_match.group(1).upper() if op_match else ''
+            # 逐行扫描：头部的 [FILE]: / [OP]:，随后的 [ANCHOR] 与 [CONTENT] 区域
+            file_path = ''
+            operation_str = None
+            anchor_lines = []
+            content_lines = []
+            section = None
+            for line in inner.split('\n'):
+                marker = line.strip()
+                if section is not content_lines and marker == '[CONTENT]':
+                    section = content_lines
+                    continue
+                if section is None:
+                    if marker == '[ANCHOR]':
+                        section = anchor_lines
+                    elif marker.startswith('[FILE]:') and not file_path:
+                        file_path = marker[len('[FILE]:'):].strip()
+                    elif marker.startswith('[OP]:') and operation_str is None:
+                        operation_str = marker[len('[OP]:'):].strip().upper()
+                    continue
+                # 区域开头的空白行不计入
+                if section or marker:
+                    section.append(line)
             
-            try:
-                operation = Operation(operation_str)
-            except ValueError:
+            operation = cls.OP_MAP.get(operation_str)
+            if operation is None:
                 continue  # 跳过无效操作
             
-            # 解析 [ANCHOR] 部分
-            anchor = ''
-            anchor_match = re.search(r'\[ANCHOR\]\s*\n([\s\S]*?)(?=\[CONTENT\]|$)', inner)
-            if anchor_match:
-                anchor = anchor_match.group(1).rstrip('\n')
-            
-            # 解析 [CONTENT] 部分
-            content_text = ''
-            content_match = re.search(r'\[CONTENT\]\s*\n([\s\S]*?)$', inner)
-            if content_match:
-                content_text = content_match.group(1).rstrip('\n')
+            anchor = '\n'.join(anchor_lines).rstrip('\n')
+            content_text = '\n'.join(content_lines).rstrip('\n')
             
             patches.append(Patch(
                 file=file_path,
@@ -151,23 +158,29 @@ class FIUPParser:
                 raw=raw
             ))
         
-        return patches
+        return tuple(patches)
     
     @classmethod
     def extract_blocks(cls, text: str) -> list[str]:
         """从文本中提取所有FIUP块的原始文本"""
-        content = cls._strip_code_blocks(text)
         blocks = []
-        for match in cls.BLOCK_PATTERN.finditer(content):
+        for match in cls.BLOCK_PATTERN.finditer(text):
             blocks.append(match.group(0))
         return blocks
     
     @classmethod
     def validate(cls, text: str) -> tuple[bool, list[str]]:
         """验证补丁格式，返回 (是否有效, 错误/警告列表)"""
+        valid, messages = cls._validate_cached(text)
+        return valid, list(messages)
+    
+    @classmethod
+    @functools.lru_cache(maxsize=8)
+    def _validate_cached(cls, text: str) -> tuple[bool, tuple[str, ...]]:
+        """验证补丁格式，结果按文本缓存"""
         errors = []
         warnings = []
-        patches = cls.parse(text)
+        patches = cls._parse_cached(text)
         
         if not patches:
             if "<<<FIUP>>>" in text:
@@ -181,7 +194,7 @@ class FIUPParser:
             else:
                 errors.append("未检测到有效的 FIUP 补丁块")
                 errors.append("提示: v3.0 格式使用 <<<FIUP>>> 和 <<<END>>> 标记")
-            return False, errors
+            return False, tuple(errors)
         
         for i, patch in enumerate(patches):
             prefix = f"补丁 #{i+1}: "
@@ -193,20 +206,21 @@ class FIUPParser:
                 if not patch.content.strip():
                     errors.append(f"{prefix}CREATE 操作但内容为空")
             else:
-                if not patch.anchor.strip():
+                anchor = patch.anchor.strip()
+                if not anchor:
                     errors.append(f"{prefix}锚点内容为空")
                 
-                anchor_lines = len(patch.anchor.strip().splitlines())
+                anchor_lines = anchor.count('\n') + 1 if anchor else 0
                 if anchor_lines < 2:
                     warnings.append(f"{prefix}⚠ 锚点仅 {anchor_lines} 行，建议 3-6 行以确保唯一性")
                 
                 if patch.operation != Operation.DELETE and not patch.content.strip():
                     errors.append(f"{prefix}非 DELETE/CREATE 操作但内容为空")
             
-            if '...' in patch.anchor or '# ...' in patch.anchor:
+            if '...' in patch.anchor:
                 warnings.append(f"{prefix}⚠ 锚点中包含 '...'，这可能导致匹配失败")
         
-        return len(errors) == 0, errors + warnings
+        return len(errors) == 0, tuple(errors + warnings)
 
 
 # ============== 文本匹配器 ==============
@@ -214,64 +228,105 @@ class FIUPParser:
 class TextMatcher:
     """文本匹配器，支持精确和模糊匹配"""
     
-    @staticmethod
-    def normalize_whitespace(text: str) -> str:
-        """规范化空白字符"""
-        lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
-        return '\n'.join(line.rstrip() for line in lines)
+    # 不属于 \r\n 的单独 \r（按换行处理，替换为 \n 不改变长度）
+    LONE_CR_PATTERN = re.compile(r'\r(?!\n)')
+    
+    @classmethod
+    def normalize_whitespace(cls, text: str) -> str:
+        """规范化空白字符：去除行尾空白，统一换行符为 \\n"""
+        # \r\n 中的 \r 属于行尾空白，会被 rstrip 一并去掉
+        if '\r' in text:
+            text = cls.LONE_CR_PATTERN.sub('\n', text)
+        return '\n'.join(map(str.rstrip, text.split('\n')))
+    
+    @classmethod
+    def normalize_with_offsets(cls, text: str) -> tuple[str, tuple[list[int], list[int]]]:
+        """
+        规范化空白字符，同时返回位置映射表
+        映射表为 (规范化文本中的位置, 该位置处累计删除的字符数)，位置单调递增
+        """
+        if '\r' in text:
+            text = cls.LONE_CR_PATTERN.sub('\n', text)
+        lines = text.split('\n')
+        stripped = list(map(str.rstrip, lines))
+        
+        positions = []
+        removed = []
+        pos = 0
+        total = 0
+        for line, kept in zip(lines, stripped):
+            pos += len(kept)
+            if len(kept) != len(line):
+                total += len(line) - len(kept)
+                positions.append(pos)
+                removed.append(total)
+            pos += 1
+        return '\n'.join(stripped), (positions, removed)
     
     @classmethod
     def find_anchor(cls, content: str, anchor: str, 
                     fuzzy_threshold: float = 0.85,
-                    strict: bool = False) -> tuple[MatchResult, int, int, list]:
+                    strict: bool = False,
+                    normalized: Optional[tuple[str, tuple[list[int], list[int]]]] = None,
+                    need_similar: bool = False) -> tuple[MatchResult, int, int, list]:
         """
         在内容中查找锚点
+        normalized: 可选，content 的 normalize_with_offsets 结果（已计算时传入以免重复规范化）
+        need_similar: 是否收集相似候选（仅用于失败诊断，不需要时跳过以加快模糊匹配）
         返回: (匹配类型, 开始位置, 结束位置, 相似候选列表)
         """
-        norm_content = cls.normalize_whitespace(content)
+        norm_content, offsets = normalized or cls.normalize_with_offsets(content)
         norm_anchor = cls.normalize_whitespace(anchor)
         similar_candidates = []
         
+        # 0. 锚点即全文（如整文件替换）
+        if norm_anchor == norm_content:
+            original_end = cls._map_position_to_original(offsets, len(norm_content))
+            return MatchResult.EXACT, 0, original_end, []
+        
         # 1. 精确匹配
         pos = norm_content.find(norm_anchor)
         if pos != -1:
+            original_pos = cls._map_position_to_original(offsets, pos)
+            original_end = cls._map_position_to_original(offsets, pos + len(norm_anchor))
+            
             second_pos = norm_content.find(norm_anchor, pos + 1)
             if second_pos != -1:
-                return MatchResult.MULTIPLE, pos, pos + len(norm_anchor), []
-            
-            original_pos = cls._map_position_to_original(content, norm_content, pos)
-            original_end = cls._map_position_to_original(content, norm_content, pos + len(norm_anchor))
+                return MatchResult.MULTIPLE, original_pos, original_end, []
             return MatchResult.EXACT, original_pos, original_end, []
         
         # 2. 模糊匹配
         if strict:
-            similar_candidates = cls._find_similar_fragments(norm_content, norm_anchor, top_k=3)
+            if need_similar:
+                similar_candidates = cls._find_similar_fragments(norm_content, norm_anchor, top_k=3)
             return MatchResult.NOT_FOUND, -1, -1, similar_candidates
         
         content_lines = norm_content.split('\n')
         anchor_lines = norm_anchor.split('\n')
+        anchor_len = len(anchor_lines)
+        line_starts = cls._line_starts(content_lines)
         
         best_ratio = 0.0
         best_start_line = -1
         candidates = []
         
-        for i in range(len(content_lines) - len(anchor_lines) + 1):
-            candidate = '\n'.join(content_lines[i:i + len(anchor_lines)])
-            ratio = difflib.SequenceMatcher(None, candidate, norm_anchor).ratio()
-            
-            if ratio > 0.6:
-                candidates.append((ratio, i, candidate))
+        # 不收集候选时，低于阈值的窗口都可以直接排除
+        floor = min(0.6, fuzzy_threshold) if need_similar else fuzzy_threshold
+        for ratio, i in cls._score_windows(norm_content, content_lines, line_starts, anchor_lines, floor):
+            if need_similar and ratio > 0.6:
+                candidates.append((ratio, i, norm_content[line_starts[i]:line_starts[i + anchor_len] - 1]))
             
             if ratio > best_ratio:
                 best_ratio = ratio
                 best_start_line = i
         
-        candidates.sort(reverse=True, key=lambda x: x[0])
-        similar_candidates = [(c[0], c[2], c[1]+1) for c in candidates[:3]]
+        if candidates:
+            candidates.sort(reverse=True, key=lambda x: x[0])
+            similar_candidates = [(c[0], c[2], c[1]+1) for c in candidates[:3]]
         
         if best_ratio >= fuzzy_threshold:
-            start_pos = sum(len(line) + 1 for line in content_lines[:best_start_line])
-            end_pos = start_pos + sum(len(line) + 1 for line in content_lines[best_start_line:best_start_line + len(anchor_lines)]) - 1
+            start_pos = cls._map_position_to_original(offsets, line_starts[best_start_line])
+            end_pos = cls._map_position_to_original(offsets, line_starts[best_start_line + anchor_len] - 1)
             return MatchResult.FUZZY, start_pos, end_pos, similar_candidates
         
         return MatchResult.NOT_FOUND, -1, -1, similar_candidates
@@ -282,39 +337,144 @@ class TextMatcher:
         content_lines = content.split('\n')
         anchor_lines = anchor.split('\n')
         anchor_len = len(anchor_lines)
+        line_starts = cls._line_starts(content_lines)
         
         candidates = []
-        for i in range(len(content_lines) - anchor_len + 1):
-            candidate = '\n'.join(content_lines[i:i + anchor_len])
-            ratio = difflib.SequenceMatcher(None, candidate, anchor).ratio()
+        for ratio, i in cls._score_windows(content, content_lines, line_starts, anchor_lines, 0.4):
             if ratio > 0.4:
-                candidates.append((ratio, candidate, i + 1))
+                candidates.append((ratio, content[line_starts[i]:line_starts[i + anchor_len] - 1], i + 1))
         
         candidates.sort(reverse=True, key=lambda x: x[0])
         return candidates[:top_k]
     
+    @classmethod
+    def _score_windows(cls, content: str, content_lines: list[str], line_starts: list[int],
+                       anchor_lines: list[str], floor: float):
+        """
+        逐窗口计算相似度，生成 (相似度, 起始行) ，只保证给出相似度不低于 floor 的窗口
+        依次用 real_quick_ratio / quick_ratio 这两个上界排除窗口，剩下的才做完整比较；
+        窗口文本直接按 line_starts 从 content 切片，不再逐窗口拼接
+        """
+        anchor_len = len(anchor_lines)
+        # 锚点固定为 seq2，其字符统计只计算一次
+        matcher = difflib.SequenceMatcher(None)
+        matcher.set_seq2('\n'.join(anchor_lines))
+        
+        for i in range(len(content_lines) - anchor_len + 1):
+            matcher.set_seq1(content[line_starts[i]:line_starts[i + anchor_len] - 1])
+            if matcher.real_quick_ratio() < floor or matcher.quick_ratio() < floor:
+                continue
+            ratio = cls._similarity(content_lines[i:i + anchor_len], anchor_lines, floor)
+            if ratio >= floor:
+                yield ratio, i
+    
     @staticmethod
-    def _map_position_to_original(original: str, normalized: str, norm_pos: int) -> int:
-        """将规范化后的位置映射回原始文本"""
-        if len(original) == len(normalized):
-            return norm_pos
-        
-        orig_idx = 0
-        norm_idx = 0
-        
-        while norm_idx < norm_pos and orig_idx < len(original):
-            if original[orig_idx] == normalized[norm_idx]:
-                orig_idx += 1
-                norm_idx += 1
-            elif original[orig_idx] in ' \t' and (norm_idx >= len(normalized) or normalized[norm_idx] == '\n'):
-                orig_idx += 1
-            elif original[orig_idx] == '\r':
-                orig_idx += 1
+    def _line_starts(lines: list[str]) -> list[int]:
+        """每行在 '\\n'.join(lines) 中的起始偏移，末尾附加总长度 + 1"""
+        return list(itertools.accumulate((len(line) + 1 for line in lines), initial=0))
+    
+    @classmethod
+    def _similarity(cls, a_lines: list[str], b_lines: list[str], floor: float = 0.0) -> float:
+        """
+        按行计算相似度
+        先按行求最长公共子序列（空行不作为对齐点），相同的行整体计入匹配，
+        只对夹在其间的改动行段做字符级比较；
+        若按改动行段估算的上界已低于 floor，直接返回该上界
+        
+        注意：结果不等于 SequenceMatcher.ratio()，而是 2*公共子序列长度/总长度。
+        ratio() 贪心选取最长匹配块，遇到重复字符（如 '====' 分隔线）时可能错位而偏低，
+        这里的得分通常更接近真实的公共部分，因此少数 ratio() 低于阈值的锚点会被判为 FUZZY，
+        个别模糊匹配的起始行也可能与 ratio() 的选择相差一行
+        """
+        if a_lines == b_lines:
+            return 1.0
+        total = sum(map(len, a_lines)) + sum(map(len, b_lines)) + len(a_lines) + len(b_lines)
+        
+        # 公共前后缀行直接计入匹配
+        limit = min(len(a_lines), len(b_lines))
+        pre = 0
+        while pre < limit and a_lines[pre] == b_lines[pre]:
+            pre += 1
+        suf = 0
+        while suf < limit - pre and a_lines[-1 - suf] == b_lines[-1 - suf]:
+            suf += 1
+        matched = sum(len(line) + 1 for line in a_lines[:pre])
+        matched += sum(len(line) + 1 for line in a_lines[len(a_lines) - suf:])
+        a_mid = a_lines[pre:len(a_lines) - suf]
+        b_mid = b_lines[pre:len(b_lines) - suf]
+        n, m = len(a_mid), len(b_mid)
+        
+        # lcs[i][j]: a_mid[i:] 与 b_mid[j:] 的公共行按字符数加权的最大匹配
+        lcs = [[0] * (m + 1) for _ in range(n + 1)]
+        for i in range(n - 1, -1, -1):
+            row, below, line = lcs[i], lcs[i + 1], a_mid[i]
+            weight = len(line) + 1
+            for j in range(m - 1, -1, -1):
+                if line and line == b_mid[j]:
+                    row[j] = below[j + 1] + weight
+                else:
+                    row[j] = below[j] if below[j] >= row[j + 1] else row[j + 1]
+        
+        # 沿公共子序列收集夹在相同行之间的改动行段
+        gaps = []
+        i = j = gap_i = gap_j = 0
+        while i < n and j < m:
+            if a_mid[i] and a_mid[i] == b_mid[j] and lcs[i][j] == lcs[i + 1][j + 1] + len(a_mid[i]) + 1:
+                if gap_i < i and gap_j < j:
+                    gaps.append(('\n'.join(a_mid[gap_i:i]) + '\n', '\n'.join(b_mid[gap_j:j]) + '\n'))
+                matched += len(a_mid[i]) + 1
+                i += 1
+                j += 1
+                gap_i, gap_j = i, j
+            elif lcs[i + 1][j + 1] == lcs[i][j]:
+                # 不损失匹配时沿对角线前进，让被改动的行两两对齐
+                i += 1
+                j += 1
+            elif lcs[i + 1][j] >= lcs[i][j + 1]:
+                i += 1
             else:
-                orig_idx += 1
-                norm_idx += 1
+                j += 1
+        if gap_i < n and gap_j < m:
+            gaps.append(('\n'.join(a_mid[gap_i:]) + '\n', '\n'.join(b_mid[gap_j:]) + '\n'))
+        
+        bound = matched + sum(min(len(a_gap), len(b_gap)) for a_gap, b_gap in gaps)
+        upper = 2.0 * max(bound - 1, 0) / (total - 2)
+        if upper < floor:
+            return upper
+        
+        for a_gap, b_gap in gaps:
+            matched += cls._match_count(a_gap, b_gap)
+        # 扣除两侧虚拟的末尾换行，结果对应原字符串的一个公共子序列
+        return 2.0 * max(matched - 1, 0) / (total - 2)
+    
+    @staticmethod
+    def _match_count(a: str, b: str) -> int:
+        """
+        字符级匹配数，公共前后缀直接计入，只对中间部分运行 SequenceMatcher
+        先去掉公共前后缀会改变 SequenceMatcher 的贪心选块，结果可能高于对原串直接计算的匹配数
+        """
+        limit = min(len(a), len(b))
+        pre = 0
+        while pre < limit and a[pre] == b[pre]:
+            pre += 1
+        suf = 0
+        while suf < limit - pre and a[-1 - suf] == b[-1 - suf]:
+            suf += 1
         
-        return orig_idx
+        a_mid = a[pre:len(a) - suf]
+        b_mid = b[pre:len(b) - suf]
+        matched = pre + suf
+        if a_mid and b_mid:
+            matcher = difflib.SequenceMatcher(None, a_mid, b_mid)
+            matched += sum(block.size for block in matcher.get_matching_blocks())
+        return matched
+    
+    @staticmethod
+    def _map_position_to_original(offsets: tuple[list[int], list[int]], norm_pos: int) -> int:
+        """将规范化后的位置映射回原始文本（offsets 来自 normalize_with_offsets）"""
+        positions, removed = offsets
+        idx = bisect.bisect_left(positions, norm_pos)
+        return norm_pos + removed[idx - 1] if idx else norm_pos
     
     @staticmethod
     def get_line_number(content: str, position: int) -> int:
@@ -327,6 +487,16 @@ class TextMatcher:
 class FIUPApplier:
     """应用 FIUP 补丁"""
     
+    # 操作类型 -> 新内容构造函数 (原文, 补丁内容, 锚点起始, 锚点结束)，各片段一次性拼接
+    _HANDLERS = {
+        Operation.REPLACE: lambda c, new, s, e: ''.join((c[:s], new, c[e:])),
+        Operation.INSERT_AFTER: lambda c, new, s, e: ''.join(
+            (c[:e], '' if c.endswith('\n', s, e) else '\n', new, c[e:])),
+        Operation.INSERT_BEFORE: lambda c, new, s, e: ''.join(
+            (c[:s], new, '' if new.endswith('\n') else '\n', c[s:])),
+        Operation.DELETE: lambda c, new, s, e: c[:s] + c[e:],
+    }
+    
     def __init__(self, target_dir: Path, backup: bool = True, 
                  dry_run: bool = False, strict: bool = False,
                  interactive: bool = False):
@@ -337,6 +507,8 @@ class FIUPApplier:
         self.interactive = interactive
         self.backup_dir: Optional[Path] = None
         self.created_files: list[Path] = []
+        # 文件 -> (原文, 规范化文本, 位置映射表)，原文对象变化即失效
+        self._norm_cache: dict[str, tuple[str, str, tuple[list[int], list[int]]]] = {}
     
     def apply_all(self, patches: list[Patch]) -> list[ApplyResult]:
         """应用所有补丁"""
@@ -348,6 +520,7 @@ class FIUPApplier:
             self.backup_dir.mkdir(parents=True, exist_ok=True)
         
         file_contents: dict[str, str] = {}
+        backed_up: set[Path] = set()
         
         for patch in patches:
             # CREATE 操作特殊处理
@@ -370,12 +543,20 @@ class FIUPApplier:
                     ))
                     continue
                 
-                file_contents[patch.file] = file_path.read_text(encoding='utf-8')
+                # 只读一次：同一份字节既用于备份也用于解码
+                data = file_path.read_bytes()
+                file_contents[patch.file] = (
+                    data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+                )
                 
                 if self.backup and not self.dry_run:
                     backup_path = self.backup_dir / patch.file
-                    backup_path.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.copy2(file_path, backup_path)
+                    # 不同写法的路径（如 a.py 与 ./a.py）只备份一次
+                    if backup_path.resolve() not in backed_up:
+                        backed_up.add(backup_path.resolve())
+                        backup_path.parent.mkdir(parents=True, exist_ok=True)
+                        backup_path.write_bytes(data)
+                        shutil.copystat(file_path, backup_path)
             
             content = file_contents[patch.file]
             result = self._apply_patch(content, patch)
@@ -391,12 +572,13 @@ class FIUPApplier:
                 file_contents[patch.file] = result.new_text
         
         if not self.dry_run:
+            failed_files = {r.patch.file for r in results if not r.success}
             for file_rel, content in file_contents.items():
+                if file_rel in failed_files:
+                    continue
                 file_path = self.target_dir / file_rel
-                file_results = [r for r in results if r.patch.file == file_rel]
-                if all(r.success for r in file_results):
-                    file_path.parent.mkdir(parents=True, exist_ok=True)
-                    file_path.write_text(content, encoding='utf-8')
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                file_path.write_text(content, encoding='utf-8')
         
         return results
     
@@ -428,10 +610,17 @@ class FIUPApplier:
     def _apply_patch(self, content: str, patch: Patch) -> ApplyResult:
         """应用单个补丁"""
         match_result, start, end, similar = TextMatcher.find_anchor(
-            content, patch.anchor, strict=self.strict
+            content, patch.anchor, strict=self.strict,
+            normalized=self._normalized(patch.file, content)
         )
         
         if match_result == MatchResult.NOT_FOUND:
+            # 失败时再收集相似候选用于提示（规范化结果已缓存）
+            _, _, _, similar = TextMatcher.find_anchor(
+                content, patch.anchor, strict=self.strict,
+                normalized=self._normalized(patch.file, content),
+                need_similar=True
+            )
             msg = "锚点未找到"
             if similar:
                 msg += "，最相似的代码片段:"
@@ -472,23 +661,20 @@ class FIUPApplier:
             similar_candidates=similar
         )
     
+    def _normalized(self, file_rel: str, content: str) -> tuple[str, tuple[list[int], list[int]]]:
+        """获取文件内容的规范化结果，内容未变化时复用缓存"""
+        cached = self._norm_cache.get(file_rel)
+        if cached is None or cached[0] is not content:
+            cached = (content, *TextMatcher.normalize_with_offsets(content))
+            self._norm_cache[file_rel] = cached
+        return cached[1], cached[2]
+    
     def _construct_new_content(self, content: str, patch: Patch, start: int, end: int) -> str:
-        """构造新内容"""
-        before = content[:start]
-        after = content[end:]
-        matched = content[start:end]
-        
-        if patch.operation == Operation.REPLACE:
-            return before + patch.content + after
-        elif patch.operation == Operation.INSERT_AFTER:
-            separator = '\n' if not matched.endswith('\n') else ''
-            return before + matched + separator + patch.content + after
-        elif patch.operation == Operation.INSERT_BEFORE:
-            separator = '\n' if not patch.content.endswith('\n') else ''
-            return before + patch.content + separator + matched + after
-        elif patch.operation == Operation.DELETE:
-            return before + after
-        return content
+        """构造新内容（按操作类型查表分派）"""
+        handler = self._HANDLERS.get(patch.operation)
+        if handler is None:
+            return content
+        return handler(content, patch.content, start, end)
     
     def _confirm_fuzzy_match(self, result: ApplyResult) -> bool:
         """交互式确认模糊匹配"""
@@ -523,8 +709,8 @@ def print_colored(text: str, color: str = "default"):
     print(f"{colors.get(color, '')}{text}{reset}")
 
 
-def print_diff(old_text: str, new_text: str, file_name: str = "", context_lines: int = 3):
-    """打印两段文本的差异"""
+def print_diff(old_text: str, new_text: str, file_name: str = "", context_lines: int = 3) -> bool:
+    """打印两段文本的差异，返回是否存在差异"""
     old_lines = old_text.splitlines(keepends=True)
     new_lines = new_text.splitlines(keepends=True)
     
@@ -536,7 +722,9 @@ def print_diff(old_text: str, new_text: str, file_name: str = "", context_lines:
         n=context_lines
     )
     
+    has_diff = False
     for line in diff:
+        has_diff = True
         if line.startswith('+') and not line.startswith('+++'):
             print_colored(line.rstrip(), "green")
         elif line.startswith('-') and not line.startswith('---'):
@@ -545,6 +733,7 @@ def print_diff(old_text: str, new_text: str, file_name: str = "", context_lines:
             print_colored(line.rstrip(), "cyan")
         else:
             print(line.rstrip())
+    return has_diff
 
 
 def print_similar_candidates(candidates: list):
@@ -809,6 +998,8 @@ def cmd_undo(args):
 
 def cmd_diff(args):
     """diff 命令"""
+    import filecmp
+    
     file1 = Path(args.file1)
     file2 = Path(args.file2)
     
@@ -819,18 +1010,175 @@ def cmd_diff(args):
         print_colored(f"错误: 文件不存在: {file2}", "red")
         return 1
     
-    text1 = file1.read_text(encoding='utf-8')
-    text2 = file2.read_text(encoding='utf-8')
+    # 同一文件（如 a.py 与 ./a.py、硬链接）或字节完全相同时无需读取和比较文本
+    # filecmp 先比较大小，再分块逐字节比较，遇到第一处不同即返回
+    if not (file1.samefile(file2) or filecmp.cmp(file1, file2, shallow=False)):
+        text1 = file1.read_text(encoding='utf-8')
+        text2 = file2.read_text(encoding='utf-8')
+        if print_diff(text1, text2, file1.name):
+            return 0
     
-    print_diff(text1, text2, file1.name)
+    # 字节相同或仅换行符不同（CRLF/LF），文本上均无差异
+    print_colored("两个文件内容相同", "green")
     return 0
 
 
 # ============== 主入口 ==============
 
+@functools.cache
+def _fast_parser_class():
+    """
+    返回添加参数时复用格式化器的 ArgumentParser 子类
+    argparse 每次 add_argument 都会新建一个格式化器（构造时查询终端尺寸）仅用于校验 metavar，
+    这里在添加参数期间复用同一个；生成帮助时仍每次新建，避免共享格式化状态
+    """
+    import argparse
+    
+    class _FastParser(argparse.ArgumentParser):
+        _adding_argument = False
+        _check_formatter = None
+        
+        def add_argument(self, *args, **kwargs):
+            self._adding_argument = True
+            try:
+                return super().add_argument(*args, **kwargs)
+            finally:
+                self._adding_argument = False
+        
+        def _get_formatter(self):
+            if not self._adding_argument:
+                return super()._get_formatter()
+            if self._check_formatter is None:
+                self._check_formatter = super()._get_formatter()
+            return self._check_formatter
+    
+    return _FastParser
+
+
+@functools.cache
+def _shared_options() -> tuple:
+    """
+    顶层、apply、preview 共用的选项，作为 parents 只定义一次
+    返回: (补丁读取/匹配选项, 写入选项)；--target 各处是否必填不同，不在其中
+    """
+    parser_class = _fast_parser_class()
+    
+    input_opts = parser_class(add_help=False)
+    input_opts.add_argument('--clipboard', '-c', action='store_true', help='从剪贴板读取')
+    input_opts.add_argument('--strict', '-s', action='store_true', help='严格模式（禁用模糊匹配）')
+    input_opts.add_argument('--interactive', '-i', action='store_true', help='交互式确认模糊匹配')
+    
+    write_opts = parser_class(add_help=False)
+    write_opts.add_argument('--dry-run', '-n', action='store_true', help='预览模式')
+    write_opts.add_argument('--verbose', '-v', action='store_true', help='显示详细差异')
+    write_opts.add_argument('--backup', '-b', action='store_true', default=True, help='备份原文件')
+    write_opts.add_argument('--no-backup', action='store_false', dest='backup', help='不备份')
+    
+    return input_opts, write_opts
+
+
+def _build_apply(subparsers):
+    input_opts, write_opts = _shared_options()
+    apply_p = subparsers.add_parser('apply', parents=[input_opts, write_opts], help='应用补丁')
+    apply_p.add_argument('patch_file', nargs='?', default='-', help='补丁文件（- 表示stdin）')
+    apply_p.add_argument('--target', '-t', required=True, help='目标目录或文件')
+
+
+def _build_preview(subparsers):
+    input_opts, _ = _shared_options()
+    preview_p = subparsers.add_parser('preview', parents=[input_opts],
+                                      help='预览变更（等同于 apply --dry-run -v）')
+    preview_p.add_argument('patch_file', nargs='?', default='-', help='补丁文件（- 表示stdin）')
+    preview_p.add_argument('--target', '-t', required=True, help='目标目录或文件')
+
+
+def _build_validate(subparsers):
+    validate_p = subparsers.add_parser('validate', help='验证补丁格式')
+    validate_p.add_argument('patch_file', help='补丁文件')
+
+
+def _build_extract(subparsers):
+    extract_p = subparsers.add_parser('extract', help='从文件中提取FIUP块')
+    extract_p.add_argument('input_file', help='输入文件（如AI对话记录）')
+    extract_p.add_argument('--output', '-o', help='输出文件')
+
+
+def _build_undo(subparsers):
+    undo_p = subparsers.add_parser('undo', help='从备份恢复')
+    undo_p.add_argument('--target', '-t', required=True, help='目标目录')
+    undo_p.add_argument('--list', '-l', action='store_true', help='列出所有备份')
+    undo_p.add_argument('--backup-name', help='指定备份名称')
+    undo_p.add_argument('--dry-run', '-n', action='store_true')
+
+
+def _build_diff(subparsers):
+    diff_p = subparsers.add_parser('diff', help='比较两个文件')
+    diff_p.add_argument('file1', help='原始文件')
+    diff_p.add_argument('file2', help='修改后文件')
+
+
+# 子命令名 -> (子解析器构造函数, 命令处理函数)，参数预判、解析器构造与分派共用
+# 顺序即帮助中的显示顺序
+SUBCOMMANDS = {
+    'apply': (_build_apply, cmd_apply),
+    'preview': (_build_preview, cmd_preview),
+    'validate': (_build_validate, cmd_validate),
+    'extract': (_build_extract, cmd_extract),
+    'undo': (_build_undo, cmd_undo),
+    'diff': (_build_diff, cmd_diff),
+}
+
+
+def _sniff_subcommand(argv: list[str]) -> tuple[Optional[str], bool]:
+    """
+    在完整解析前找出子命令
+    返回: (第一个位置参数，没有时为 None, 子命令之前是否请求了帮助)
+    顶层选项中只有 --target/-t 带值，需跳过其后的参数
+    """
+    wants_help = False
+    args = iter(argv)
+    for arg in args:
+        if arg == '--':
+            return arg, wants_help
+        if arg.startswith('--'):
+            # 长选项允许前缀缩写（如 --tar、--he）；--target=x 形式不消耗下一个参数
+            if '=' not in arg and len(arg) > 2:
+                if '--target'.startswith(arg):
+                    next(args, None)
+                elif '--help'.startswith(arg):
+                    wants_help = True
+        elif arg.startswith('-') and len(arg) > 1:
+            # 短选项可合并（如 -ct ./dir、-vh）；-t 之后的字符都是它的值
+            flags = arg[1:]
+            value_at = flags.find('t')
+            if 'h' in (flags if value_at == -1 else flags[:value_at]):
+                wants_help = True
+            if value_at == len(flags) - 1:
+                next(args, None)
+        else:
+            return arg, wants_help
+    return None, wants_help
+
+
 def main():
-    parser = argparse.ArgumentParser(
+    argv = sys.argv[1:]
+    # 版本查询无需构造解析器
+    if argv[:1] in (['--version'], ['-V']):
+        print(f"fiup {__version__}")
+        return 0
+    
+    import argparse
+    
+    parser_class = _fast_parser_class()
+    
+    # 顶层独有的选项放在最前，其余与子命令共用
+    top_opts = parser_class(add_help=False)
+    top_opts.add_argument('--version', '-V', action='version', version=f'fiup {__version__}')
+    top_opts.add_argument('--target', '-t', help='目标目录或文件')
+    
+    parser = parser_class(
         prog='fiup',
+        parents=[top_opts, *_shared_options()],
         description="FIUP Tool v3.0 - 文件增量更新协议工具",
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
@@ -852,75 +1200,38 @@ v3.0 格式:
         """
     )
     
-    parser.add_argument('--version', '-V', action='version', version=f'%(prog)s {__version__}')
-    parser.add_argument('--target', '-t', help='目标目录或文件')
-    parser.add_argument('--clipboard', '-c', action='store_true', help='从剪贴板读取')
-    parser.add_argument('--dry-run', '-n', action='store_true', help='预览模式')
-    parser.add_argument('--verbose', '-v', action='store_true', help='显示详细差异')
-    parser.add_argument('--strict', '-s', action='store_true', help='严格模式（禁用模糊匹配）')
-    parser.add_argument('--interactive', '-i', action='store_true', help='交互式确认模糊匹配')
-    parser.add_argument('--backup', '-b', action='store_true', default=True, help='备份原文件')
-    parser.add_argument('--no-backup', action='store_false', dest='backup', help='不备份')
-    
-    subparsers = parser.add_subparsers(dest='command', help='命令')
-    
-    apply_p = subparsers.add_parser('apply', help='应用补丁')
-    apply_p.add_argument('patch_file', nargs='?', default='-', help='补丁文件（- 表示stdin）')
-    apply_p.add_argument('--target', '-t', required=True, help='目标目录或文件')
-    apply_p.add_argument('--backup', '-b', action='store_true', default=True)
-    apply_p.add_argument('--no-backup', action='store_false', dest='backup')
-    apply_p.add_argument('--dry-run', '-n', action='store_true')
-    apply_p.add_argument('--verbose', '-v', action='store_true')
-    apply_p.add_argument('--strict', '-s', action='store_true')
-    apply_p.add_argument('--interactive', '-i', action='store_true')
-    apply_p.add_argument('--clipboard', '-c', action='store_true')
-    
-    preview_p = subparsers.add_parser('preview', help='预览变更（等同于 apply --dry-run -v）')
-    preview_p.add_argument('patch_file', nargs='?', default='-')
-    preview_p.add_argument('--target', '-t', required=True)
-    preview_p.add_argument('--strict', '-s', action='store_true')
-    preview_p.add_argument('--interactive', '-i', action='store_true')
-    preview_p.add_argument('--clipboard', '-c', action='store_true')
-    
-    validate_p = subparsers.add_parser('validate', help='验证补丁格式')
-    validate_p.add_argument('patch_file', help='补丁文件')
-    
-    extract_p = subparsers.add_parser('extract', help='从文件中提取FIUP块')
-    extract_p.add_argument('input_file', help='输入文件（如AI对话记录）')
-    extract_p.add_argument('--output', '-o', help='输出文件')
-    
-    undo_p = subparsers.add_parser('undo', help='从备份恢复')
-    undo_p.add_argument('--target', '-t', required=True, help='目标目录')
-    undo_p.add_argument('--list', '-l', action='store_true', help='列出所有备份')
-    undo_p.add_argument('--backup-name', help='指定备份名称')
-    undo_p.add_argument('--dry-run', '-n', action='store_true')
-    
-    diff_p = subparsers.add_parser('diff', help='比较两个文件')
-    diff_p.add_argument('file1', help='原始文件')
-    diff_p.add_argument('file2', help='修改后文件')
+    subparsers = parser.add_subparsers(dest='command', help='命令', parser_class=parser_class)
+    
+    # 只构造实际用到的子解析器：
+    #   - 子命令之前请求了帮助（含 --he、-vh 等写法）或命令未知时全部构造，以便列出可选命令
+    #   - 识别出子命令时只构造该子命令
+    #   - 没有位置参数时（如 fiup -t ./src）无需任何子解析器
+    command, wants_help = _sniff_subcommand(argv)
+    if wants_help or (command is not None and command not in SUBCOMMANDS):
+        for build, _ in SUBCOMMANDS.values():
+            build(subparsers)
+    elif command is not None:
+        SUBCOMMANDS[command][0](subparsers)
+    else:
+        # 未构造子解析器时，用法提示中仍列出全部命令
+        subparsers.metavar = '{' + ','.join(SUBCOMMANDS) + '}'
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
+    # 省略子命令但给出目标时（如 fiup -t ./src），按 apply 处理
     if args.command is None and args.target:
         args.command = 'apply'
         args.patch_file = '-'
-        return cmd_apply(args)
-    
-    if args.command == 'apply':
-        return cmd_apply(args)
-    elif args.command == 'preview':
-        return cmd_preview(args)
-    elif args.command == 'validate':
-        return cmd_validate(args)
-    elif args.command == 'extract':
-        return cmd_extract(args)
-    elif args.command == 'undo':
-        return cmd_undo(args)
-    elif args.command == 'diff':
-        return cmd_diff(args)
-    else:
-        parser.print_help()
-        return 0
+    
+    if args.command in SUBCOMMANDS:
+        return SUBCOMMANDS[args.command][1](args)
+    
+    if not subparsers.choices:
+        subparsers.metavar = None
+        for build, _ in SUBCOMMANDS.values():
+            build(subparsers)
+    parser.print_help()
+    return 0
 
 
 if __name__ == '__main__':